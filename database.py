@@ -53,3 +53,10 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
         cursor = cursor.limit(limit)
     
     return list(cursor)
+
+def aggregate_documents(collection_name: str, pipeline: list):
+    """Run an aggregation pipeline and return the resulting documents"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return list(db[collection_name].aggregate(pipeline))
@@ -0,0 +1,138 @@
+"""
+Image Hashing Helpers
+
+Perceptual hashing used by image search. Pillow and numpy are optional:
+when either is missing HASHING_AVAILABLE is False and callers should degrade
+gracefully instead of failing at import time.
+"""
+
+import threading
+from io import BytesIO
+from typing import Any, BinaryIO, List, Tuple, Union
+
+try:
+    import numpy as np
+    from PIL import Image
+    HASHING_AVAILABLE = True
+except ImportError:
+    np = None
+    Image = None
+    HASHING_AVAILABLE = False
+
+HASH_SIZE = 8
+# Side of the grayscale tile the DCT runs on (imagehash's hash_size * highfreq_factor)
+PHASH_IMG_SIZE = HASH_SIZE * 4
+# pHash works on a 32x32 resample, so decoding beyond 64x64 is wasted pixel work
+DRAFT_SIZE = 64
+# Max Hamming distance between two pHashes for them to count as the same card
+MATCH_THRESHOLD = 6
+# Refuse to decode anything larger (~6300x6300); a crafted PNG header can otherwise demand gigabytes
+MAX_IMAGE_PIXELS = 40_000_000
+
+
+class ImageTooLarge(Exception):
+    """Raised instead of decoding an image whose declared size exceeds MAX_IMAGE_PIXELS"""
+
+
+if HASHING_AVAILABLE:
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    # Low-frequency rows of the (unnormalized) 32-point DCT-II basis; scale does not matter for a median split
+    _n = np.arange(PHASH_IMG_SIZE)
+    _DCT_LOW = np.cos(np.pi * np.outer(np.arange(HASH_SIZE), 2 * _n + 1) / (2 * PHASH_IMG_SIZE)).astype(np.float32)
+
+
+def phash64(pixels) -> int:
+    """
+    pHash of a 32x32 grayscale tile, bit-compatible with imagehash.phash.
+    Only the 8x8 low-frequency block is needed, so compute it directly as two small float32 matmuls
+    instead of a full float64 2D DCT.
+    """
+    low = _DCT_LOW @ pixels.astype(np.float32) @ _DCT_LOW.T
+    bits = (low > np.median(low)).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def decode_and_hash(data: Union[bytes, str, BinaryIO]) -> int:
+    """Decode an image (bytes, path or file-like) and return its packed 64-bit pHash"""
+    if isinstance(data, bytes):
+        data = BytesIO(data)
+    try:
+        img = Image.open(data)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+    with img:
+        # Image.open only reads the header; Pillow merely warns between 1x and 2x its limit, so check here
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise ImageTooLarge(f"Image of {img.width}x{img.height} pixels exceeds the {MAX_IMAGE_PIXELS} pixel limit")
+        # JPEG only: let libjpeg decode straight to grayscale at a reduced IDCT scale; no-op for other formats
+        img.draft("L", (DRAFT_SIZE, DRAFT_SIZE))
+        tile = img.convert("L").resize((PHASH_IMG_SIZE, PHASH_IMG_SIZE), Image.Resampling.LANCZOS)
+        return phash64(np.asarray(tile, dtype=np.uint8))
+
+
+def hash_to_hex(h: int) -> str:
+    """Hex form stored in Mongo (same layout as str(ImageHash))"""
+    return f"{h:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def hamming(a: int, b: int) -> int:
+    """Hamming distance between two packed hashes"""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over packed hashes under Hamming distance.
+    Lookups only descend into children whose edge distance can still be within the radius,
+    so a radius query touches a small fraction of the stored hashes.
+    """
+
+    def __init__(self):
+        # Node layout: (hash, [values], {edge_distance: child_node})
+        self._root = None
+        self._size = 0
+        # Writers run in the threadpool while readers run on the event loop
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, h: int, value: Any) -> None:
+        """Insert a hash with an associated value (e.g. a document id)"""
+        with self._lock:
+            if self._root is None:
+                self._root = (h, [value], {})
+                self._size = 1
+                return
+            node = self._root
+            while True:
+                d = hamming(h, node[0])
+                if d == 0:
+                    if value not in node[1]:
+                        node[1].append(value)
+                        self._size += 1
+                    return
+                child = node[2].get(d)
+                if child is None:
+                    node[2][d] = (h, [value], {})
+                    self._size += 1
+                    return
+                node = child
+
+    def find(self, h: int, radius: int) -> List[Tuple[int, Any]]:
+        """Return (distance, value) pairs within radius of h, closest first"""
+        with self._lock:
+            if self._root is None:
+                return []
+            found = []
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                d = hamming(h, node[0])
+                if d <= radius:
+                    found.extend((d, v) for v in node[1])
+                for edge, child in node[2].items():
+                    if d - radius <= edge <= d + radius:
+                        stack.append(child)
+        found.sort(key=lambda m: m[0])
+        return found
@@ -1,18 +1,99 @@
+import asyncio
 import os
-from typing import List, Optional
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urljoin, urlsplit
 
 import re
-import requests
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import shutil
+import httpx
+from fastapi import BackgroundTasks, FastAPI, Request, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional: fall back to the regex parser when selectolax is unavailable
+    LexborHTMLParser = None
+
 # Minimal, robust backend: avoid heavy optional deps to ensure boot reliability.
-from database import create_document, get_documents, db
+from database import aggregate_documents, create_document, db
 from schemas import CollectionEntry
+from image_hashing import HASHING_AVAILABLE, MATCH_THRESHOLD, BKTree, ImageTooLarge, decode_and_hash, hamming, hash_to_hex
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+# How often each worker pulls newly hashed entries (possibly written by other workers) into its index
+COLLECTION_SYNC_INTERVAL = 5
+# Re-read a little before the watermark: a write stamped earlier can land after the previous sync ran
+COLLECTION_SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def ensure_collection_indexes() -> None:
+    # Serves the incremental sync's updated_at range query instead of a collection scan
+    db["collectionentry"].create_index("updated_at")
+
+
+def load_collection_index(index: BKTree, since: Optional[datetime] = None) -> datetime:
+    """Add collection entries hashed at or after `since` (all when None) to the index; return the next watermark"""
+    # Mongo hands back naive UTC datetimes, so keep the watermark naive too
+    started = datetime.now(timezone.utc).replace(tzinfo=None)
+    query = {"phash": {"$type": "string"}}
+    if since is not None:
+        query["updated_at"] = {"$gte": since - COLLECTION_SYNC_OVERLAP}
+    for doc in db["collectionentry"].find(query, {"phash": 1}):
+        index.add(int(doc["phash"], 16), str(doc["_id"]))
+    return started
+
+
+async def sync_collection_index(app: FastAPI) -> None:
+    """Keep this worker's pHash index current in the background; the request path never waits on Mongo"""
+    if db is None:
+        return
+    indexed = False
+    while True:
+        try:
+            if not indexed:
+                await asyncio.to_thread(ensure_collection_indexes)
+                indexed = True
+            app.state.collection_index_synced_at = await asyncio.to_thread(
+                load_collection_index, app.state.collection_index, app.state.collection_index_synced_at
+            )
+        except Exception:
+            pass  # Mongo unreachable: image search still works against Cardmarket, /test reports the DB state
+        await asyncio.sleep(COLLECTION_SYNC_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background so startup never waits on Mongo; searches see entries as they arrive
+    app.state.collection_index = BKTree()
+    app.state.collection_index_synced_at = None
+    sync_task = asyncio.create_task(sync_collection_index(app))
+    # One pooled client per process so outbound calls reuse TCP/TLS connections
+    app.state.http = httpx.AsyncClient(
+        headers=HEADERS,
+        timeout=15,
+        # retries only re-attempt failed connects, like urllib3's Retry on connection errors
+        transport=httpx.AsyncHTTPTransport(http2=True, limits=httpx.Limits(max_keepalive_connections=32), retries=2),
+    )
+    try:
+        yield
+    finally:
+        sync_task.cancel()
+        await app.state.http.aclose()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,14 +139,43 @@ def test_database():
 
 
 # ---------- Currency ----------
+RATE_CACHE_TTL = 600
+RATE_CACHE_MAXSIZE = 256
+# (FROM, TO) -> (expires_at, in-flight or finished fetch); sharing the task also collapses concurrent misses
+_rate_cache: Dict[Tuple[str, str], Tuple[float, "asyncio.Future[dict]"]] = {}
+
+
+async def _fetch_rate(client: httpx.AsyncClient, frm: str, to: str) -> dict:
+    r = await client.get(f"https://api.exchangerate.host/convert?from={frm}&to={to}", timeout=10)
+    data = r.json()
+    if not data.get("success", True):
+        raise Exception("Rate API error")
+    return {"from": frm, "to": to, "rate": float(data.get("result"))}
+
+
+def _drop_failed_rate(key: Tuple[str, str], entry: Tuple[float, "asyncio.Future[dict]"]) -> None:
+    """Done-callback: evict a failed fetch (only if it is still the cached one) so the next caller retries"""
+    task = entry[1]
+    # exception() also marks it retrieved, so a fetch nobody awaited doesn't log "never retrieved"
+    if task.cancelled() or task.exception() is not None:
+        if _rate_cache.get(key) is entry:
+            del _rate_cache[key]
+
+
 @app.get("/api/rate")
-def get_rate(frm: str = "USD", to: str = "EUR"):
+async def get_rate(request: Request, frm: str = "USD", to: str = "EUR"):
+    key = (frm.upper(), to.upper())
+    now = time.monotonic()
+    entry = _rate_cache.get(key)
+    if entry is None or entry[0] <= now:
+        if entry is None and len(_rate_cache) >= RATE_CACHE_MAXSIZE:
+            _rate_cache.pop(next(iter(_rate_cache)))
+        entry = (now + RATE_CACHE_TTL, asyncio.ensure_future(_fetch_rate(request.app.state.http, *key)))
+        _rate_cache[key] = entry
+        entry[1].add_done_callback(lambda _, key=key, entry=entry: _drop_failed_rate(key, entry))
     try:
-        r = requests.get(f"https://api.exchangerate.host/convert?from={frm}&to={to}", timeout=10)
-        data = r.json()
-        if not data.get("success", True):
-            raise Exception("Rate API error")
-        return {"from": frm.upper(), "to": to.upper(), "rate": float(data.get("result"))}
+        # shield: a disconnecting client must not cancel the fetch other callers are waiting on
+        return await asyncio.shield(entry[1])
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Failed to fetch rate: {e}")
 
@@ -80,54 +190,107 @@ class SearchResult(BaseModel):
     source: str
 
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.9",
-}
-
-
 _id_pat = re.compile(r"OP\d{2}-\d{3}", re.IGNORECASE)
 _lang_hint = re.compile(r"(english|japanese)", re.IGNORECASE)
+# Use single-quoted Python strings to avoid escaping inner double quotes
+_anchor_pat = re.compile(r'<a[^>]+href="(/en/OnePiece/[^"]+)"[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+_img_pat = re.compile(r'<img[^>]+(?:data-src|src)="([^"]+)"', re.IGNORECASE)
+_tag_pat = re.compile(r"<[^>]+>")
+_unsafe_filename_chars = re.compile(r"[^A-Za-z0-9._-]")
+_results_container = re.compile(r'<div[^>]+class="[^"]*\b(?:table-body|product-list|search-results)\b', re.IGNORECASE)
+
+
+def _extract_id_code(text: str) -> Optional[str]:
+    idm = _id_pat.search(text)
+    return idm.group(0).upper() if idm else None
+
+
+def _extract_language(text: str) -> Optional[str]:
+    langm = _lang_hint.search(text)
+    if not langm:
+        return None
+    return "EN" if langm.group(1).lower() == "english" else "JP"
+
+
+# ---------- Cardmarket scraping (selectolax) ----------
+def parse_cardmarket_search(html: str) -> List[SearchResult]:
+    """Parse Cardmarket search rows with lexbor (C parser); only the matched rows are wrapped in Python."""
+    tree = LexborHTMLParser(html)
+    rows = tree.css(".table-body .row, .product-list .row") or tree.css(".search-results .row")
+    results: List[SearchResult] = []
+    seen = set()
+    for row in rows:
+        link = row.css_first("a[href*='/en/OnePiece/Products']")
+        href = link.attributes.get("href") if link is not None else None
+        if not href:
+            continue
+        full_url = "https://www.cardmarket.com" + href.split("?")[0]
+        if full_url in seen:
+            continue
+        seen.add(full_url)
+
+        img = row.css_first("img")
+        img_url = (img.attributes.get("data-src") or img.attributes.get("src")) if img is not None else None
+        name = link.text(separator=" ", strip=True)
+        text = row.text(separator=" ", strip=True)
+        results.append(SearchResult(id_code=_extract_id_code(text), name=name or None, language=_extract_language(text),
+                                    image_url=img_url, source_url=full_url, source="cardmarket"))
+    return results[:48]
 
 
 # ---------- Cardmarket scraping (regex-lite) ----------
 def parse_cardmarket_search_regex(html: str) -> List[SearchResult]:
     results: List[SearchResult] = []
-    # Use single-quoted Python string to avoid escaping inner double quotes
-    for m in re.finditer(r'<a[^>]+href="(/en/OnePiece/[^"]+)"[^>]*>(.*?)</a>', html, re.IGNORECASE | re.DOTALL):
+    seen = set()
+    for m in _anchor_pat.finditer(html):
         href = m.group(1)
-        text = re.sub("<[^>]+>", " ", m.group(2)).strip()
-        start = m.end()
-        snippet = html[start:start+400]
-        img_match = re.search(r'<img[^>]+(?:data-src|src)="([^"]+)"', snippet, re.IGNORECASE)
+        full_url = "https://www.cardmarket.com" + href.split("?")[0]
+        if full_url in seen:
+            continue
+        seen.add(full_url)
+
+        text = _tag_pat.sub(" ", m.group(2)).strip()
+        # Look for the thumbnail in the 400 chars after the anchor without slicing out a copy
+        img_match = _img_pat.search(html, m.end(), m.end() + 400)
         img_url = img_match.group(1) if img_match else None
 
-        id_code = None
-        idm = _id_pat.search(text)
-        if idm:
-            id_code = idm.group(0).upper()
+        id_code = _extract_id_code(text)
+        language = _extract_language(text)
+        results.append(SearchResult(id_code=id_code, name=text or None, language=language, image_url=img_url, source_url=full_url, source="cardmarket"))
+    return results[:48]
 
-        language = None
-        langm = _lang_hint.search(text)
-        if langm:
-            language = "EN" if langm.group(1).lower() == "english" else ("JP" if langm.group(1).lower()=="japanese" else None)
 
-        full_url = "https://www.cardmarket.com" + href.split("?")[0]
-        if not any(r.source_url == full_url for r in results):
-            results.append(SearchResult(id_code=id_code, name=text or None, language=language, image_url=img_url, source_url=full_url, source="cardmarket"))
-    return results[:48]
+def _strain_search_html(html: str) -> str:
+    """Drop the page chrome before the first results container so neither parser has to walk it."""
+    m = _results_container.search(html)
+    return html[m.start():] if m else html
+
+
+def parse_cardmarket_search_html(html: str) -> List[SearchResult]:
+    """Prefer the DOM parser; fall back to regex when selectolax is missing or the layout didn't match."""
+    html = _strain_search_html(html)
+    if LexborHTMLParser is not None:
+        parsed = parse_cardmarket_search(html)
+        if parsed:
+            return parsed
+    return parse_cardmarket_search_regex(html)
+
+
+async def fetch_cardmarket_search(client: httpx.AsyncClient, q: str) -> List[SearchResult]:
+    url = f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={quote(q)}"
+    r = await client.get(url)
+    if r.status_code != 200:
+        return []
+    return parse_cardmarket_search_html(r.text)
 
 
 @app.get("/api/search/cardmarket", response_model=List[SearchResult])
-def search_cardmarket(q: str):
+async def search_cardmarket(request: Request, q: str):
     # Always try remote search first
     try:
-        url = f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={requests.utils.quote(q)}"
-        r = requests.get(url, headers=HEADERS, timeout=15)
-        if r.status_code == 200:
-            parsed = parse_cardmarket_search_regex(r.text)
-            if parsed:
-                return parsed
+        parsed = await fetch_cardmarket_search(request.app.state.http, q)
+        if parsed:
+            return parsed
         # If blocked/unavailable or parsed empty, fall back gracefully
     except Exception:
         pass
@@ -140,7 +303,7 @@ def search_cardmarket(q: str):
             name=q.strip(),
             language=None,
             image_url=None,
-            source_url=f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={requests.utils.quote(q)}",
+            source_url=f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={quote(q)}",
             source="cardmarket",
         ))
     # Fallback 2: empty array (200 OK) so frontend can show "no results" without error
@@ -152,7 +315,7 @@ def build_pricecharting_stub(q: str) -> Optional[SearchResult]:
     if not q:
         return None
     # Construct a search URL on PriceCharting (they may not list cards, this is a stub link)
-    url = f"https://www.pricecharting.com/search-products?type=prices&q={requests.utils.quote(q)}"
+    url = f"https://www.pricecharting.com/search-products?type=prices&q={quote(q)}"
     return SearchResult(id_code=_id_pat.search(q).group(0).upper() if _id_pat.search(q) else None,
                         name=q.strip(), language=None, image_url=None, source_url=url, source="pricecharting")
 
@@ -161,7 +324,7 @@ def build_cardtrader_stub(q: str) -> Optional[SearchResult]:
     if not q:
         return None
     # CardTrader One Piece search page (query param may vary; use generic and safe link)
-    url = f"https://www.cardtrader.com/en/one_piece_card_game/products?search%5Bquery%5D={requests.utils.quote(q)}"
+    url = f"https://www.cardtrader.com/en/one_piece_card_game/products?search%5Bquery%5D={quote(q)}"
     return SearchResult(id_code=_id_pat.search(q).group(0).upper() if _id_pat.search(q) else None,
                         name=q.strip(), language=None, image_url=None, source_url=url, source="cardtrader")
 
@@ -170,23 +333,19 @@ def build_collectr_stub(q: str) -> Optional[SearchResult]:
     if not q:
         return None
     # Collectr generic search link
-    url = f"https://www.collectr.store/search?q={requests.utils.quote(q)}"
+    url = f"https://www.collectr.store/search?q={quote(q)}"
     return SearchResult(id_code=_id_pat.search(q).group(0).upper() if _id_pat.search(q) else None,
                         name=q.strip(), language=None, image_url=None, source_url=url, source="collectr")
 
 
 @app.get("/api/search", response_model=List[SearchResult])
-def search_all(q: str):
+async def search_all(request: Request, q: str):
     """Aggregate search across multiple sources. Always returns 200 with results or stubs/empty."""
     results: List[SearchResult] = []
 
     # Cardmarket first (best data when available)
     try:
-        url = f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={requests.utils.quote(q)}"
-        r = requests.get(url, headers=HEADERS, timeout=15)
-        if r.status_code == 200:
-            parsed = parse_cardmarket_search_regex(r.text)
-            results.extend(parsed)
+        results.extend(await fetch_cardmarket_search(request.app.state.http, q))
     except Exception:
         pass
 
@@ -194,15 +353,17 @@ def search_all(q: str):
     pc = build_pricecharting_stub(q)
     ct = build_cardtrader_stub(q)
     co = build_collectr_stub(q)
+    seen = {(r.source, r.source_url) for r in results}
     for s in [pc, ct, co]:
-        if s and not any(r.source == s.source and r.source_url == s.source_url for r in results):
+        if s and (s.source, s.source_url) not in seen:
+            seen.add((s.source, s.source_url))
             results.append(s)
 
     # If nothing and ID-like query, ensure at least one stub per source
     if not results and _id_pat.search(q or ""):
         for s in [
             SearchResult(id_code=_id_pat.search(q).group(0).upper(), name=q.strip(), language=None, image_url=None,
-                         source_url=f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={requests.utils.quote(q)}", source="cardmarket"),
+                         source_url=f"https://www.cardmarket.com/en/OnePiece/Products/Search?searchString={quote(q)}", source="cardmarket"),
             build_pricecharting_stub(q),
             build_cardtrader_stub(q),
             build_collectr_stub(q),
@@ -214,39 +375,141 @@ def search_all(q: str):
 
 
 # ---------- Image upload & matching ----------
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+
+def ensure_upload_size(file: UploadFile) -> None:
+    """Reject oversized uploads with 413 before anything copies or decodes them"""
+    # The body is already spooled by Starlette, so seeking to the end is cheap and exact
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+
+
 @app.post("/api/upload-image")
 def upload_image(file: UploadFile = File(...)):
+    ensure_upload_size(file)
     try:
         filename = (file.filename or "upload").replace(" ", "_")
         base, ext = os.path.splitext(filename)
-        safe = re.sub(r"[^A-Za-z0-9._-]", "_", base) + (ext if ext else "")
+        safe = _unsafe_filename_chars.sub("_", base) + (ext if ext else "")
         out_path = os.path.join(UPLOAD_DIR, safe)
         with open(out_path, "wb") as f:
-            while True:
-                chunk = file.file.read(1024 * 1024)
-                if not chunk:
-                    break
-                f.write(chunk)
+            shutil.copyfileobj(file.file, f, length=1024 * 1024)
         url = f"/uploads/{os.path.basename(out_path)}"
         return {"url": url}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
 
 
+CANDIDATE_HASH_CACHE_MAXSIZE = 10_000
+# image URL -> (ETag, packed pHash); revalidated with If-None-Match so unchanged thumbnails skip download and decode
+_candidate_hashes: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+
+
+def _remember_candidate_hash(url: str, entry: Tuple[str, int]) -> None:
+    # (Re-)insert rather than move_to_end: a concurrent search may have evicted url while we awaited the fetch
+    _candidate_hashes[url] = entry
+    _candidate_hashes.move_to_end(url)
+    if len(_candidate_hashes) > CANDIDATE_HASH_CACHE_MAXSIZE:
+        _candidate_hashes.popitem(last=False)
+
+
+async def candidate_hash(client: httpx.AsyncClient, url: str) -> Optional[int]:
+    cached = _candidate_hashes.get(url)
+    r = await client.get(url, headers={"If-None-Match": cached[0]} if cached else None)
+    if r.status_code == 304 and cached:
+        _remember_candidate_hash(url, cached)
+        return cached[1]
+    if r.status_code != 200:
+        return None
+    h = await asyncio.to_thread(decode_and_hash, r.content)
+    etag = r.headers.get("ETag")
+    if etag:
+        _remember_candidate_hash(url, (etag, h))
+    return h
+
+
+def collection_matches(target: int, hits: List[Tuple[int, str]]) -> List[SearchResult]:
+    """Load index hits from Mongo, re-checking distance since replaced images leave stale index entries"""
+    from bson import ObjectId
+    ids = list(dict.fromkeys(entry_id for _, entry_id in hits))
+    docs = {str(d["_id"]): d for d in db["collectionentry"].find({"_id": {"$in": [ObjectId(i) for i in ids]}})}
+    matches = []
+    for entry_id in ids:
+        d = docs.get(entry_id)
+        if not d or not d.get("phash"):
+            continue
+        distance = hamming(target, int(d["phash"], 16))
+        if distance <= MATCH_THRESHOLD:
+            matches.append((distance, SearchResult(
+                id_code=d.get("id_code"),
+                name=d.get("name"),
+                language=d.get("language"),
+                image_url=d.get("custom_image_url") or d.get("image_url"),
+                source_url=d.get("source_url") or d.get("custom_image_url"),
+                source="collection",
+            )))
+    matches.sort(key=lambda m: m[0])
+    return [m for _, m in matches]
+
+
 @app.post("/api/search/by-image", response_model=List[SearchResult])
-def search_by_image(file: UploadFile = File(...), q: Optional[str] = Form(None)):
-    # Degraded behavior: image-based matching not implemented in this environment
-    raise HTTPException(status_code=501, detail="Image search is temporarily unavailable in this environment.")
+async def search_by_image(request: Request, file: UploadFile = File(...), q: Optional[str] = Form(None)):
+    if not HASHING_AVAILABLE:
+        # Degraded behavior: Pillow/numpy are not installed in this environment
+        raise HTTPException(status_code=501, detail="Image search is temporarily unavailable in this environment.")
+    ensure_upload_size(file)
+    try:
+        # Pillow reads the spooled upload directly; no intermediate bytes copy
+        target = await asyncio.to_thread(decode_and_hash, file.file)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+    # The user's own collection first: sub-linear lookup in the pHash index
+    results: List[SearchResult] = []
+    hits = request.app.state.collection_index.find(target, MATCH_THRESHOLD)
+    if hits:
+        try:
+            results.extend(await asyncio.to_thread(collection_matches, target, hits))
+        except Exception:
+            pass
+
+    # Cardmarket candidates come from a text search; without a query there is nothing more to compare against
+    if not q:
+        return results
+    client = request.app.state.http
+    try:
+        candidates = [c for c in await fetch_cardmarket_search(client, q) if c.image_url]
+    except Exception:
+        return results
+
+    # Fetch (or revalidate) and hash all candidate images concurrently; decoding runs off the event loop
+    hashes = await asyncio.gather(
+        *(candidate_hash(client, urljoin("https://www.cardmarket.com/", c.image_url)) for c in candidates),
+        return_exceptions=True,
+    )
+    # At most 48 candidates: a plain int.bit_count() loop beats numpy's array setup at this size
+    scored = [(hamming(target, h), c) for c, h in zip(candidates, hashes) if isinstance(h, int)]
+    matches = [(d, c) for d, c in scored if d <= MATCH_THRESHOLD]
+    matches.sort(key=lambda m: m[0])
+    return results + [c for _, c in matches]
 
 
 # ---------- Collection CRUD ----------
 @app.get("/api/collection")
 def list_collection():
     try:
-        docs = get_documents("collectionentry", {})
-        for d in docs:
-            d["_id"] = str(d.get("_id"))
-        return docs
+        # Project server-side and let Mongo stringify _id so no per-doc fix-up is needed here
+        return aggregate_documents("collectionentry", [
+            # Exclude only internal fields so the response keeps every stored field
+            {"$project": {"phash": 0}},
+            {"$addFields": {"_id": {"$toString": "$_id"}}},
+        ])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -263,8 +526,33 @@ class AddToCollectionPayload(BaseModel):
     purchase_currency: str = "USD"
 
 
+def store_entry_phash(entry_id: str, phash: str) -> bool:
+    """Record the hash of an entry's source image unless a custom image (which wins) has been set meanwhile"""
+    from bson import ObjectId
+    result = db["collectionentry"].update_one(
+        {"_id": ObjectId(entry_id), "custom_image_url": None},
+        {"$set": {"phash": phash, "updated_at": datetime.now(timezone.utc)}},
+    )
+    return result.modified_count > 0
+
+
+async def index_entry_image(app: FastAPI, entry_id: str, image_url: str) -> None:
+    """Hash a new entry's source image after the response, so image search covers entries without a custom upload"""
+    url = urljoin("https://www.cardmarket.com/", image_url)
+    # image_url comes from the client: only fetch Cardmarket-hosted images, never arbitrary (e.g. internal) hosts
+    host = urlsplit(url).hostname or ""
+    if urlsplit(url).scheme != "https" or not (host == "cardmarket.com" or host.endswith(".cardmarket.com")):
+        return
+    try:
+        h = await candidate_hash(app.state.http, url)
+        if h is not None and await asyncio.to_thread(store_entry_phash, entry_id, hash_to_hex(h)):
+            app.state.collection_index.add(h, entry_id)
+    except Exception:
+        pass  # best effort: the entry is saved either way, it just won't match by image
+
+
 @app.post("/api/collection")
-def add_to_collection(payload: AddToCollectionPayload):
+def add_to_collection(payload: AddToCollectionPayload, request: Request, background_tasks: BackgroundTasks):
     try:
         entry = CollectionEntry(
             id_code=payload.id_code,
@@ -278,26 +566,41 @@ def add_to_collection(payload: AddToCollectionPayload):
             purchase_currency=payload.purchase_currency.upper(),
         )
         new_id = create_document("collectionentry", entry)
+        if HASHING_AVAILABLE and payload.image_url:
+            background_tasks.add_task(index_entry_image, request.app, new_id, payload.image_url)
         return {"_id": new_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.put("/api/collection/{entry_id}/image")
-def set_custom_image(entry_id: str, file: UploadFile = File(...)):
+def set_custom_image(request: Request, entry_id: str, file: UploadFile = File(...)):
+    ensure_upload_size(file)
+    phash = None
+    if HASHING_AVAILABLE:
+        try:
+            phash = hash_to_hex(decode_and_hash(file.file))
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception:
+            pass  # not a decodable image: keep the upload, just leave it out of image search
+        file.file.seek(0)
     try:
         filename = f"custom_{entry_id}.bin"
         out_path = os.path.join(UPLOAD_DIR, filename)
         with open(out_path, "wb") as f:
-            while True:
-                chunk = file.file.read(1024 * 1024)
-                if not chunk:
-                    break
-                f.write(chunk)
+            shutil.copyfileobj(file.file, f, length=1024 * 1024)
         url = f"/uploads/{os.path.basename(out_path)}"
         # Update DB reference
         from bson import ObjectId
-        db["collectionentry"].update_one({"_id": ObjectId(entry_id)}, {"$set": {"custom_image_url": url}})
+        db["collectionentry"].update_one({"_id": ObjectId(entry_id)}, {"$set": {
+            "custom_image_url": url,
+            "phash": phash,
+            # Bumped so other workers' incremental index sync picks this hash up
+            "updated_at": datetime.now(timezone.utc),
+        }})
+        if phash:
+            request.app.state.collection_index.add(int(phash, 16), entry_id)
         return {"custom_image_url": url}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -306,4 +609,6 @@ def set_custom_image(entry_id: str, file: UploadFile = File(...)):
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Workers need an import string; "auto" picks uvloop/httptools (uvicorn[standard]) where they are installed
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="auto", http="auto")
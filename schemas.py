@@ -34,6 +34,7 @@ class CollectionEntry(BaseModel):
     source_url: Optional[str] = Field(None)
     image_url: Optional[str] = Field(None, description="Source image URL")
     custom_image_url: Optional[str] = Field(None, description="User uploaded custom image URL")
+    phash: Optional[str] = Field(None, description="Perceptual hash (hex) of the custom image, else of the Cardmarket image_url; used by image search")
 
     quantity: int = Field(1, ge=1)
     purchase_price: float = Field(..., ge=0)